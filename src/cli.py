@@ -0,0 +1,219 @@
+""" command line entry point
+
+    $ python -m src spire --start 2019-09-01T00:00:00Z --stop 2019-09-02T00:00:00Z --callsign ANA1 --save-s3
+    $ python -m src opensky --start-date 2018-11-14 --stop-date 2018-11-16 --departure-airport Fukuoka
+    $ python -m src queue enqueue-spire --start 2019-09-01T00:00:00Z --stop 2019-12-01T00:00:00Z
+    $ python -m src queue worker --save-s3
+
+Heavy modules (pandas, traffic, boto3, requests) are imported inside the sub commands only.
+"""
+import argparse
+import datetime
+
+PATH_QUEUE_DB = 'data/output/queue/work_queue.sqlite'
+
+
+def _parse_datetime(value):
+    from dateutil.parser import isoparse
+    import pytz
+    value = isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=pytz.utc)
+    return value
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_between(value):
+    if value is None:
+        return None
+    value_0, value_1 = value.split(',')
+    return float(value_0), float(value_1)
+
+
+def _resolve_airport(value):
+    """ ICAO ident (ex. RJTT) is used as it is. Other strings are searched in airports.csv by name """
+    if (value is None) or (len(value) == 4 and value.isupper()):
+        return value
+    from src.flight_info import find_airport_ident
+    return find_airport_ident(value)
+
+
+def _add_spire_query_args(parser):
+    parser.add_argument('--start', type=_parse_datetime, required=True, help='start datetime (ISO 8601, UTC)')
+    parser.add_argument('--stop', type=_parse_datetime, required=True, help='stop datetime (ISO 8601, UTC)')
+    parser.add_argument('--query-interval-hours', type=float, default=1., help='length of one query (hours)')
+    parser.add_argument('--icao-address', default=None, help='ex. 02013F,0201xx')
+    parser.add_argument('--callsign', default=None, help='ex. RAM200,ANA1')
+    parser.add_argument('--latitude-between', type=_parse_between, default=None, help='ex. -23,12')
+    parser.add_argument('--longitude-between', type=_parse_between, default=None, help='ex. -123,-100')
+    parser.add_argument('--altitude-baro-between', type=_parse_between, default=None, help='ex. 33000,45000')
+    parser.add_argument('--out-format', default='CSV', choices=['CSV', 'JSON', 'AVRO'])
+    parser.add_argument('--compression', default=None, choices=['GZIP', 'DEFLATE', 'SNAPPY'])
+
+
+def _add_opensky_query_args(parser):
+    parser.add_argument('--start-date', type=_parse_date, required=True, help='YYYY-MM-DD')
+    parser.add_argument('--stop-date', type=_parse_date, required=True, help='YYYY-MM-DD (exclusive)')
+    parser.add_argument('--file-batch-unit', default='daily', choices=['daily', 'monthly'])
+    parser.add_argument('--callsign', default=None)
+    parser.add_argument('--icao24', default=None)
+    parser.add_argument('--departure-airport', default=None, help='ICAO ident or a part of the airport name')
+    parser.add_argument('--arrival-airport', default=None, help='ICAO ident or a part of the airport name')
+    parser.add_argument('--calc-interval-hours', type=float, default=1., help='length of one opensky query (hours)')
+
+
+def _add_save_args(parser, dir_save_default):
+    parser.add_argument('--dir-save', default=dir_save_default)
+    parser.add_argument('--save-s3', action='store_true', help='upload outputs to S3_BUCKET_NAME')
+    parser.add_argument('--remove-local-file', action='store_true')
+
+
+def _dict_spire_query(args):
+    return {
+        'icao_address': args.icao_address,
+        'callsign': args.callsign,
+        'latitude_between': args.latitude_between,
+        'longitude_between': args.longitude_between,
+        'altitude_baro_between': args.altitude_baro_between,
+    }
+
+
+def _dict_opensky_query(args):
+    return {
+        'callsign': args.callsign,
+        'icao24': args.icao24,
+        'departure_airport': _resolve_airport(args.departure_airport),
+        'arrival_airport': _resolve_airport(args.arrival_airport),
+        'calc_interval_datetime': datetime.timedelta(hours=args.calc_interval_hours),
+    }
+
+
+def run_spire(args):
+    from src.spire.historicalapi import QueryGetManager
+    query_get_manager = QueryGetManager(out_format=args.out_format, compression=args.compression)
+    list_dict = query_get_manager.query_request(args.start, args.stop,
+                                                query_time_interval=datetime.timedelta(
+                                                    hours=args.query_interval_hours),
+                                                skip_existing=not args.no_skip_existing,
+                                                dir_save=args.dir_save,
+                                                **_dict_spire_query(args))
+    print(list_dict)
+    list_path = query_get_manager.get_data_bulk(max_wait_time=args.max_wait_time,
+                                                random_wait=True,
+                                                dir_save=args.dir_save,
+                                                processes=args.processes,
+                                                save_s3=args.save_s3,
+                                                remove_local_file=args.remove_local_file,
+                                                decompress=args.decompress)
+    print(list_path)
+
+
+def run_opensky(args):
+    from src.flight_info import HistoricalLocationsData
+    historical_locations_data = HistoricalLocationsData(file_batch_unit=args.file_batch_unit)
+    list_path = historical_locations_data.get_df_time_range(start_date=args.start_date,
+                                                            stop_date=args.stop_date,
+                                                            save_local=True,
+                                                            dir_save=args.dir_save,
+                                                            file_format=args.file_format,
+                                                            **_dict_opensky_query(args))
+    print(list_path)
+
+
+def run_queue_enqueue_spire(args):
+    from src.work_queue import SQLiteWorkQueue, enqueue_spire_slices
+    queue = SQLiteWorkQueue(args.path_db)
+    n_added = enqueue_spire_slices(queue, args.start, args.stop,
+                                   datetime.timedelta(hours=args.query_interval_hours),
+                                   out_format=args.out_format, compression=args.compression,
+                                   **_dict_spire_query(args))
+    print('enqueued: {0}  {1}'.format(n_added, queue.count_state()))
+
+
+def run_queue_enqueue_opensky(args):
+    from src.work_queue import SQLiteWorkQueue, enqueue_opensky_units
+    queue = SQLiteWorkQueue(args.path_db)
+    n_added = enqueue_opensky_units(queue, args.start_date, args.stop_date, file_batch_unit=args.file_batch_unit,
+                                    **_dict_opensky_query(args))
+    print('enqueued: {0}  {1}'.format(n_added, queue.count_state()))
+
+
+def run_queue_worker(args):
+    from src.work_queue import SQLiteWorkQueue, run_worker
+    queue = SQLiteWorkQueue(args.path_db, lease_time=args.lease_time)
+    dict_task_options = {
+        'spire': {'save_s3': args.save_s3, 'remove_local_file': args.remove_local_file,
+                  'max_wait_time': args.max_wait_time},
+        'opensky': {'dir_save': args.dir_save_opensky, 'file_format': args.file_format_opensky},
+    }
+    if args.dir_save is not None:
+        dict_task_options['spire']['dir_save'] = args.dir_save
+    n_done = run_worker(queue, worker_id=args.worker_id, exit_when_empty=not args.keep_alive,
+                        heartbeat_interval=max(args.lease_time // 5, 1), dict_task_options=dict_task_options)
+    print('done: {0}  {1}'.format(n_done, queue.count_state()))
+
+
+def run_queue_status(args):
+    from src.work_queue import SQLiteWorkQueue
+    print(SQLiteWorkQueue(args.path_db).count_state())
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m src', description='flight data gathering')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_spire = subparsers.add_parser('spire', help='download from spire historical API')
+    _add_spire_query_args(parser_spire)
+    _add_save_args(parser_spire, 'data/output/spire/historical')
+    parser_spire.add_argument('--decompress', action='store_true', help='decompress GZIP while downloading')
+    parser_spire.add_argument('--no-skip-existing', action='store_true',
+                              help='request queries again even if they are in the manifest of dir-save')
+    parser_spire.add_argument('--processes', type=int, default=1)
+    parser_spire.add_argument('--max-wait-time', type=int, default=60)
+    parser_spire.set_defaults(func=run_spire)
+
+    parser_opensky = subparsers.add_parser('opensky', help='download from opensky history through traffic')
+    _add_opensky_query_args(parser_opensky)
+    parser_opensky.add_argument('--dir-save', default='data/output')
+    parser_opensky.add_argument('--file-format', default='pickle', choices=['pickle', 'csv', 'parquet'])
+    parser_opensky.set_defaults(func=run_opensky)
+
+    parser_queue = subparsers.add_parser('queue', help='distributed work queue on a shared SQLite file')
+    parser_queue.add_argument('--path-db', default=PATH_QUEUE_DB)
+    subparsers_queue = parser_queue.add_subparsers(dest='queue_command')
+    subparsers_queue.required = True
+
+    parser_enqueue_spire = subparsers_queue.add_parser('enqueue-spire')
+    _add_spire_query_args(parser_enqueue_spire)
+    parser_enqueue_spire.set_defaults(func=run_queue_enqueue_spire)
+
+    parser_enqueue_opensky = subparsers_queue.add_parser('enqueue-opensky')
+    _add_opensky_query_args(parser_enqueue_opensky)
+    parser_enqueue_opensky.set_defaults(func=run_queue_enqueue_opensky)
+
+    parser_worker = subparsers_queue.add_parser('worker')
+    _add_save_args(parser_worker, None)
+    parser_worker.add_argument('--dir-save-opensky', default='data/output')
+    parser_worker.add_argument('--file-format-opensky', default='pickle', choices=['pickle', 'csv', 'parquet'])
+    parser_worker.add_argument('--worker-id', default=None)
+    parser_worker.add_argument('--lease-time', type=int, default=600, help='lease time (sec)')
+    parser_worker.add_argument('--max-wait-time', type=int, default=60)
+    parser_worker.add_argument('--keep-alive', action='store_true', help='keep polling when the queue is empty')
+    parser_worker.set_defaults(func=run_queue_worker)
+
+    parser_status = subparsers_queue.add_parser('status')
+    parser_status.set_defaults(func=run_queue_status)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
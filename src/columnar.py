@@ -0,0 +1,299 @@
+import os
+import json
+import datetime
+
+DIR_INDEX = '_index'
+SORT_COLUMNS = ('timestamp', 'icao24')
+ROW_GROUP_SIZE = 100000
+COMPRESSION = 'zstd'
+
+
+def write_parquet(df, path, sort_columns=SORT_COLUMNS, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+    """ write a DataFrame as parquet sorted by sort_columns
+
+    Rows are sorted before writing, so min/max statistics of each row group are narrow and
+    filters on timestamp (and icao24) skip most row groups.
+
+    Args:
+        df (pd.DataFrame): flight data
+        path (str): path to the parquet file
+        sort_columns (tuple): columns to sort rows. Columns not in df are ignored
+        row_group_size (int): number of rows per row group
+        compression (str): parquet compression codec
+
+    Returns: path
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sort_columns = [column for column in sort_columns if column in df.columns]
+    if sort_columns:
+        df = df.sort_values(by=sort_columns, kind='mergesort')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    path_temp = path + '.tmp'
+    pq.write_table(table, path_temp, row_group_size=row_group_size, compression=compression,
+                   write_statistics=True)
+    os.replace(path_temp, path)
+    return path
+
+
+def _to_iso(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def update_dataset_index(dir_dataset, path, df, start_datetime=None, stop_datetime=None, **kwargs):
+    """ add or replace the index entry of one file of a dataset
+
+    Each file has its own small json in dir_dataset/_index, so workers writing units into the same
+    dir_dataset at the same time do not overwrite the entries of each other.
+
+    Args:
+        dir_dataset (str): directory of the dataset
+        path (str): path to the file
+        df (pd.DataFrame or ParquetSink): data written to path
+        start_datetime (datetime.datetime): start of the unit
+        stop_datetime (datetime.datetime): stop of the unit (exclusive)
+        **kwargs: other conditions of the unit (ex. callsign, departure_airport)
+
+    Returns: entry (dict)
+
+    """
+    entry = {
+        'start': _to_iso(start_datetime),
+        'stop': _to_iso(stop_datetime),
+    }
+    if isinstance(df, ParquetSink):
+        entry['n_rows'] = df.n_rows
+        if df.timestamp_min is not None:
+            entry['timestamp_min'] = _to_iso(df.timestamp_min)
+            entry['timestamp_max'] = _to_iso(df.timestamp_max)
+    else:
+        entry['n_rows'] = int(len(df))
+        if ('timestamp' in df.columns) and len(df) > 0:
+            entry['timestamp_min'] = _to_iso(df['timestamp'].min())
+            entry['timestamp_max'] = _to_iso(df['timestamp'].max())
+    entry.update({key: _to_iso(value) for key, value in kwargs.items()})
+    dir_index = os.path.join(dir_dataset, DIR_INDEX)
+    if not os.path.exists(dir_index):
+        os.makedirs(dir_index, exist_ok=True)
+    path_entry = os.path.join(dir_index, os.path.basename(path) + '.json')
+    # a unique temp name per process, then an atomic replace
+    path_temp = '{0}.{1}.tmp'.format(path_entry, os.getpid())
+    with open(path_temp, 'w') as f:
+        json.dump(entry, f, indent=1, sort_keys=True)
+    os.replace(path_temp, path_entry)
+    return entry
+
+
+def load_dataset_index(dir_dataset):
+    """ read the index entries of dir_dataset
+
+    Returns: dict of filename: entry
+
+    """
+    dir_index = os.path.join(dir_dataset, DIR_INDEX)
+    if not os.path.exists(dir_index):
+        return {}
+    dict_index = {}
+    for filename_entry in os.listdir(dir_index):
+        if not filename_entry.endswith('.json'):
+            continue
+        with open(os.path.join(dir_index, filename_entry)) as f:
+            dict_index[filename_entry[:-len('.json')]] = json.load(f)
+    return dict_index
+
+
+def read_dataset(dir_dataset, start_datetime=None, stop_datetime=None, icao24=None, columns=None, filters=None):
+    """ read a filtered subset of a parquet dataset
+
+    Files are selected by the index, and row groups are skipped by parquet statistics
+    (predicate pushdown), so whole units are not read.
+
+    Args:
+        dir_dataset (str): directory of the dataset
+        start_datetime (datetime.datetime): rows with timestamp >= start_datetime (UTC if naive)
+        stop_datetime (datetime.datetime): rows with timestamp < stop_datetime (UTC if naive)
+        icao24 (str or list): icao24 to keep
+        columns (list): columns to read. If None, all columns
+        filters (list): additional pyarrow filters, ex. [('altitude', '>=', 35000)]
+
+    Returns: pd.DataFrame
+
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+    start_datetime = None if start_datetime is None else pd.Timestamp(start_datetime)
+    stop_datetime = None if stop_datetime is None else pd.Timestamp(stop_datetime)
+    if (start_datetime is not None) and (start_datetime.tzinfo is None):
+        start_datetime = start_datetime.tz_localize('UTC')
+    if (stop_datetime is not None) and (stop_datetime.tzinfo is None):
+        stop_datetime = stop_datetime.tz_localize('UTC')
+
+    list_filter = list(filters) if filters is not None else []
+    if start_datetime is not None:
+        list_filter.append(('timestamp', '>=', start_datetime))
+    if stop_datetime is not None:
+        list_filter.append(('timestamp', '<', stop_datetime))
+    if icao24 is not None:
+        list_filter.append(('icao24', 'in', [icao24] if isinstance(icao24, str) else list(icao24)))
+
+    list_df = []
+    for filename, entry in sorted(load_dataset_index(dir_dataset).items()):
+        if entry.get('n_rows', 0) == 0 or 'timestamp_min' not in entry:
+            continue
+        if (start_datetime is not None) and pd.Timestamp(entry['timestamp_max']) < start_datetime:
+            continue
+        if (stop_datetime is not None) and pd.Timestamp(entry['timestamp_min']) >= stop_datetime:
+            continue
+        list_df.append(pq.read_table(os.path.join(dir_dataset, filename), columns=columns,
+                                     filters=list_filter if list_filter else None).to_pandas())
+    if len(list_df) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(list_df, ignore_index=True)
+
+
+class LazyParquet(object):
+    """ handle of a parquet file written by ParquetSink. Data is read only when requested
+
+    If dir_temp is given, the handle owns that temporary directory and removes it on close()
+    (or when the handle is garbage collected).
+    """
+    def __init__(self, path, dir_temp=None):
+        self.path = path
+        self.dir_temp = dir_temp
+        self._finalizer = None
+        if dir_temp is not None:
+            import shutil
+            import weakref
+            self._finalizer = weakref.finalize(self, shutil.rmtree, dir_temp, ignore_errors=True)
+
+    def close(self):
+        """ remove the temporary directory (if the handle owns one) """
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_rows(self):
+        import pyarrow.parquet as pq
+        if not os.path.exists(self.path):
+            return 0
+        return pq.ParquetFile(self.path).metadata.num_rows
+
+    def to_pandas(self, columns=None, filters=None):
+        """ read the file (or the filtered subset)
+
+        Args:
+            columns (list): columns to read. If None, all columns
+            filters (list): pyarrow filters, ex. [('icao24', '==', '86d6a4')]
+
+        Returns: pd.DataFrame
+
+        """
+        import pandas as pd
+        import pyarrow.parquet as pq
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=columns)
+        return pq.read_table(self.path, columns=columns, filters=filters).to_pandas()
+
+    def iter_batches(self, batch_size=ROW_GROUP_SIZE, columns=None):
+        """ iterate the file by batches
+
+        Returns: generator of pd.DataFrame
+
+        """
+        import pyarrow.parquet as pq
+        if not os.path.exists(self.path):
+            return
+        for batch in pq.ParquetFile(self.path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+
+def _fill_null_types(schema, null_type):
+    """ replace fields of the null type (columns with only None) by null_type """
+    import pyarrow as pa
+    return pa.schema([field.with_type(null_type) if pa.types.is_null(field.type) else field for field in schema],
+                     metadata=schema.metadata)
+
+
+class ParquetSink(object):
+    """ append DataFrames to one parquet file without keeping them in memory
+
+    Each appended slice is sorted by sort_columns and written as row groups right away, so peak
+    memory is one slice. Slices should be appended in time order to keep the file sorted by timestamp.
+    The file appears at path on close.
+    The schema of the file is fixed by the first slice (or by schema). Columns with only None in the
+    first slice (ex. squawk) are typed as null_type, so later slices with values can be cast to it.
+    """
+    def __init__(self, path, sort_columns=SORT_COLUMNS, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION,
+                 schema=None, null_type=None, dir_temp=None):
+        import pyarrow as pa
+        self.path = path
+        self.path_temp = path + '.tmp'
+        self.sort_columns = sort_columns
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.writer = None
+        self.schema = schema
+        self.null_type = pa.string() if null_type is None else null_type
+        self.dir_temp = dir_temp
+        self.n_rows = 0
+        self.timestamp_min = None
+        self.timestamp_max = None
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+    def append(self, df):
+        """ write a slice
+
+        Args:
+            df (pd.DataFrame): slice. Columns must be the same as the first slice
+
+        Returns: number of rows written so far
+
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if len(df) == 0:
+            return self.n_rows
+        sort_columns = [column for column in self.sort_columns if column in df.columns]
+        if sort_columns:
+            df = df.sort_values(by=sort_columns, kind='mergesort')
+        if self.schema is None:
+            self.schema = _fill_null_types(pa.Table.from_pandas(df, preserve_index=False).schema, self.null_type)
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path_temp, self.schema, compression=self.compression,
+                                           write_statistics=True)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.n_rows += len(df)
+        if 'timestamp' in df.columns:
+            timestamp_min = df['timestamp'].min()
+            timestamp_max = df['timestamp'].max()
+            if (self.timestamp_min is None) or (timestamp_min < self.timestamp_min):
+                self.timestamp_min = timestamp_min
+            if (self.timestamp_max is None) or (timestamp_max > self.timestamp_max):
+                self.timestamp_max = timestamp_max
+        return self.n_rows
+
+    def close(self):
+        """ finish the file
+
+        Returns: LazyParquet of the file (owning dir_temp if it is given).
+            If nothing was appended, no file is made and the handle reads empty
+
+        """
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path_temp, self.path)
+        return LazyParquet(self.path, dir_temp=self.dir_temp)
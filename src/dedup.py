@@ -0,0 +1,222 @@
+import os
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+KEY_COLUMNS = ('icao24', 'timestamp')
+TIME_COLUMN = 'timestamp'
+BUCKET_INTERVAL = pd.Timedelta(hours=1)
+MAX_RUNS = 8
+CHUNK_SIZE_READ = 1000000
+FILENAME_PROCESSED = '_processed.txt'
+BUCKET_NONE = 'bucket-none'
+
+
+def time_bucket(df, time_column=TIME_COLUMN, bucket_interval=BUCKET_INTERVAL):
+    """ name of the time bucket of each row
+
+    Args:
+        df (pd.DataFrame): target data
+        time_column (str): column of timestamp (datetime or parsable string)
+        bucket_interval (pd.Timedelta): length of a bucket
+
+    Returns: numpy array of bucket names (ex. 'bucket-20190901T0000'). Rows without timestamp are BUCKET_NONE
+
+    """
+    sr_floor = pd.to_datetime(df[time_column], utc=True).dt.floor(bucket_interval)
+    # format only the distinct buckets; strftime per row is slow
+    codes, uniques = pd.factorize(sr_floor)
+    names = np.array([value.strftime('bucket-%Y%m%dT%H%M') for value in uniques] + [BUCKET_NONE], dtype=object)
+    return names[codes]
+
+
+def read_output(path, chunksize=None):
+    """ read an output file (csv, csv.gz, json, json.gz, pkl, parquet) as an iterator of DataFrames
+
+    Args:
+        path (str): path to the file
+        chunksize (int): number of rows per chunk for csv, json and parquet. If None, the whole file is one chunk
+
+    Returns: iterator of pd.DataFrame
+
+    """
+    if path.endswith('.pkl'):
+        return iter([pd.read_pickle(path)])
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        if chunksize is None:
+            return iter([pq.read_table(path).to_pandas()])
+        return (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+    if path.endswith('.csv') or path.endswith('.csv.gz'):
+        if chunksize is None:
+            return iter([pd.read_csv(path)])
+        return pd.read_csv(path, chunksize=chunksize)
+    if path.endswith('.json') or path.endswith('.json.gz'):
+        if chunksize is None:
+            return iter([pd.read_json(path, lines=True)])
+        return pd.read_json(path, lines=True, chunksize=chunksize)
+    raise ValueError('unsupported file: {0}'.format(path))
+
+
+class DedupStore(object):
+    """ incremental deduplication of flight records over time buckets on disk
+
+    Rows are routed to buckets of bucket_interval by time_column, which is part of the key, so one bucket
+    holds every copy of a key and a new slice only touches the buckets it overlaps.
+    Each added chunk is written as a sorted, deduplicated run of its bucket without reading the stored data.
+    Runs of a bucket are merged when they reach max_runs and when the store is read, so memory is
+    bounded by one bucket plus one input chunk, and I/O does not grow with the size of the store.
+    Among duplicated keys, the row with the largest order_column wins (ex. 'ingestion_time' of spire),
+    otherwise the row added last wins, so refetched late data replaces the earlier copy.
+    """
+    def __init__(self, dir_store, key_columns=KEY_COLUMNS, time_column=TIME_COLUMN, bucket_interval=BUCKET_INTERVAL,
+                 max_runs=MAX_RUNS, order_column=None):
+        if time_column not in key_columns:
+            raise ValueError('time_column {0} must be one of key_columns {1}'.format(time_column, key_columns))
+        self.dir_store = dir_store
+        self.key_columns = list(key_columns)
+        self.time_column = time_column
+        self.bucket_interval = pd.Timedelta(bucket_interval)
+        self.max_runs = max_runs
+        self.order_column = order_column
+        if not os.path.exists(dir_store):
+            os.makedirs(dir_store)
+
+    def _sort_columns(self):
+        if self.order_column is None:
+            return self.key_columns
+        return self.key_columns + [self.order_column]
+
+    def _dedup(self, df):
+        # stable sort keeps earlier rows before later rows for equal keys
+        df = df.sort_values(by=self._sort_columns(), kind='mergesort')
+        return df.drop_duplicates(subset=self.key_columns, keep='last').reset_index(drop=True)
+
+    def list_buckets(self):
+        """ names of the buckets in time order
+
+        Returns: list of str
+
+        """
+        return sorted(name for name in os.listdir(self.dir_store)
+                      if name.startswith('bucket-') and os.path.isdir(os.path.join(self.dir_store, name)))
+
+    def _list_runs(self, bucket):
+        dir_bucket = os.path.join(self.dir_store, bucket)
+        return [os.path.join(dir_bucket, name) for name in sorted(os.listdir(dir_bucket))
+                if name.startswith('run-') and name.endswith('.pkl')]
+
+    def _write_run(self, bucket, df):
+        dir_bucket = os.path.join(self.dir_store, bucket)
+        if not os.path.exists(dir_bucket):
+            os.makedirs(dir_bucket)
+        list_run = self._list_runs(bucket)
+        run_id = int(os.path.basename(list_run[-1])[4:-4]) + 1 if list_run else 0
+        path_run = os.path.join(dir_bucket, 'run-{0:08d}.pkl'.format(run_id))
+        self._dedup(df).to_pickle(path_run + '.tmp')
+        os.replace(path_run + '.tmp', path_run)
+        return len(list_run) + 1
+
+    def compact(self, bucket):
+        """ merge the runs of a bucket into one run
+
+        Args:
+            bucket (str): name of the bucket
+
+        Returns: deduplicated pd.DataFrame of the bucket
+
+        """
+        list_run = self._list_runs(bucket)
+        if len(list_run) == 1:
+            return pd.read_pickle(list_run[0])
+        # runs are concatenated in the order they were added, so the later copy wins
+        df = self._dedup(pd.concat([pd.read_pickle(path_run) for path_run in list_run], ignore_index=True))
+        # the merged run replaces the newest run, then the older runs are removed
+        df.to_pickle(list_run[-1] + '.tmp')
+        os.replace(list_run[-1] + '.tmp', list_run[-1])
+        for path_run in list_run[:-1]:
+            os.remove(path_run)
+        return df
+
+    def add_df(self, df):
+        """ merge a DataFrame into the store
+
+        Args:
+            df (pd.DataFrame): data including key_columns (and order_column if it is set)
+
+        Returns: number of input rows
+
+        """
+        if len(df) == 0:
+            return 0
+        # csv keeps timestamps as strings while pkl, parquet and json give datetimes.
+        # compare keys as UTC datetimes, so copies from different formats are duplicates
+        df = df.copy()
+        df[self.time_column] = pd.to_datetime(df[self.time_column], utc=True)
+        if (self.order_column is not None) and not pd.api.types.is_numeric_dtype(df[self.order_column]):
+            df[self.order_column] = pd.to_datetime(df[self.order_column], utc=True)
+        sr_bucket = time_bucket(df, time_column=self.time_column, bucket_interval=self.bucket_interval)
+        for bucket, df_bucket in df.groupby(sr_bucket, sort=True):
+            if self._write_run(bucket, df_bucket) >= self.max_runs:
+                self.compact(bucket)
+        return len(df)
+
+    def list_processed(self):
+        """ list of files already merged into the store
+
+        Returns: list of paths
+
+        """
+        path_processed = os.path.join(self.dir_store, FILENAME_PROCESSED)
+        if not os.path.exists(path_processed):
+            return []
+        with open(path_processed) as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    def add_files(self, list_path, chunksize=CHUNK_SIZE_READ, skip_processed=True):
+        """ merge output files into the store incrementally
+
+        Args:
+            list_path (list): paths to output files (csv, csv.gz, json, json.gz, pkl, parquet)
+            chunksize (int): number of rows read at once
+            skip_processed (bool): If True, files merged in the previous runs are skipped
+
+        Returns: number of input rows
+
+        """
+        set_processed = set(self.list_processed()) if skip_processed else set()
+        n_rows = 0
+        for path in tqdm(list_path, total=len(list_path)):
+            if path in set_processed:
+                continue
+            for df_chunk in read_output(path, chunksize=chunksize):
+                n_rows += self.add_df(df_chunk)
+            with open(os.path.join(self.dir_store, FILENAME_PROCESSED), 'a') as f:
+                f.write(path + '\n')
+        return n_rows
+
+    def iter_partitions(self):
+        """ iterate deduplicated buckets in time order. Each bucket is sorted by key_columns
+
+        Returns: generator of pd.DataFrame
+
+        """
+        for bucket in self.list_buckets():
+            if self._list_runs(bucket):
+                yield self.compact(bucket)
+
+    def export_csv(self, path_dest):
+        """ write every bucket into one csv without loading the whole store
+
+        Args:
+            path_dest (str): path to the csv
+
+        Returns: path_dest
+
+        """
+        header = True
+        with open(path_dest, 'w') as f:
+            for df_partition in self.iter_partitions():
+                df_partition.to_csv(f, index=False, header=header)
+                header = False
+        return path_dest
@@ -0,0 +1,260 @@
+import os
+import datetime
+import numpy as np
+
+FILENAME_COUNTS = 'counts.npy'
+FILENAME_EDGES = 'edges.npz'
+ALTITUDE_EDGES_FT = np.arange(33000, 45001, 1000)
+CHUNK_SIZE_READ = 1000000
+
+
+def _to_epoch_sec(value):
+    """ datetime, np.datetime64 or array of them to epoch seconds (float) """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        value = np.datetime64(value)
+    value = np.asarray(value)
+    if np.issubdtype(value.dtype, np.datetime64):
+        return value.astype('datetime64[ns]').astype(np.int64) / 1e9
+    return value.astype(float)
+
+
+class DensityGrid(object):
+    """ count of positions on a latitude x longitude x altitude x time grid
+
+    Grids with the same lat, lon and alt edges can be merged by adding counts, so partitions (ex. days)
+    are aggregated in parallel and combined into a longer time range. Values out of the edges are ignored.
+    """
+    def __init__(self, lat_edges, lon_edges, alt_edges, time_edges, counts=None, dtype=np.uint32):
+        self.lat_edges = np.asarray(lat_edges, dtype=float)
+        self.lon_edges = np.asarray(lon_edges, dtype=float)
+        self.alt_edges = np.asarray(alt_edges, dtype=float)
+        self.time_edges = _to_epoch_sec(time_edges)
+        self.shape = (len(self.lat_edges) - 1, len(self.lon_edges) - 1, len(self.alt_edges) - 1,
+                      len(self.time_edges) - 1)
+        if counts is None:
+            counts = np.zeros(self.shape, dtype=dtype)
+        if counts.shape != self.shape:
+            raise ValueError('shape of counts {0} does not match edges {1}'.format(counts.shape, self.shape))
+        self.counts = counts
+
+    @classmethod
+    def from_resolution(cls, time_start, time_stop, time_step=datetime.timedelta(hours=1), resolution_deg=1.,
+                        lat_range=(-90., 90.), lon_range=(-180., 180.), alt_edges=ALTITUDE_EDGES_FT,
+                        dtype=np.uint32):
+        """ grid with regular latitude, longitude and time bins
+
+        Args:
+            time_start (datetime.datetime): start of the first time bin
+            time_stop (datetime.datetime): stop of the last time bin
+            time_step (datetime.timedelta): length of a time bin
+            resolution_deg (float): size of latitude and longitude bins (deg)
+            lat_range (tuple): (min, max) of latitude
+            lon_range (tuple): (min, max) of longitude
+            alt_edges (array): edges of altitude bins (ft)
+            dtype (np.dtype): dtype of counts
+
+        Returns: DensityGrid
+
+        """
+        lat_edges = np.arange(lat_range[0], lat_range[1] + resolution_deg / 2., resolution_deg)
+        lon_edges = np.arange(lon_range[0], lon_range[1] + resolution_deg / 2., resolution_deg)
+        time_start_sec = _to_epoch_sec(time_start)
+        time_stop_sec = _to_epoch_sec(time_stop)
+        time_step_sec = time_step.total_seconds()
+        time_edges = np.arange(time_start_sec, time_stop_sec + time_step_sec / 2., time_step_sec)
+        return cls(lat_edges, lon_edges, alt_edges, time_edges, dtype=dtype)
+
+    def empty_like(self):
+        return DensityGrid(self.lat_edges, self.lon_edges, self.alt_edges, self.time_edges,
+                           dtype=self.counts.dtype)
+
+    def add(self, lat, lon, altitude, time_sec):
+        """ count positions
+
+        Args:
+            lat, lon (np.ndarray): coordinates in degrees
+            altitude (np.ndarray): altitude (ft)
+            time_sec (np.ndarray): epoch seconds or datetime64
+
+        Returns: number of positions counted (inside the grid)
+
+        """
+        list_index = []
+        valid = np.ones(len(lat), dtype=bool)
+        for values, edges in ((lat, self.lat_edges), (lon, self.lon_edges), (altitude, self.alt_edges),
+                              (_to_epoch_sec(time_sec), self.time_edges)):
+            values = np.asarray(values, dtype=float)
+            index = np.searchsorted(edges, values, side='right') - 1
+            # the last edge is inclusive
+            index[values == edges[-1]] = len(edges) - 2
+            valid &= (index >= 0) & (index < len(edges) - 1)
+            list_index.append(index)
+        flat_index = np.ravel_multi_index([index[valid] for index in list_index], self.shape)
+        # add only the touched cells; a dense bincount would allocate the whole grid per call
+        cells, counts_cell = np.unique(flat_index, return_counts=True)
+        self.add_cells(cells, counts_cell)
+        return int(valid.sum())
+
+    def add_cells(self, cells, counts_cell):
+        """ add counts to cells given by flat indexes
+
+        Args:
+            cells (np.ndarray): unique flat indexes of counts (see np.ravel_multi_index)
+            counts_cell (np.ndarray): count of each cell
+
+        Returns: self
+
+        """
+        self._ensure_writable()
+        counts_flat = self.counts.reshape(-1)
+        if not np.shares_memory(counts_flat, self.counts):
+            raise ValueError('counts must be a contiguous array')
+        counts_flat[cells] += np.asarray(counts_cell).astype(self.counts.dtype)
+        return self
+
+    def nonzero_cells(self):
+        """ sparse form of counts (flat indexes and counts of the non-zero cells)
+
+        Returns: (cells, counts_cell)
+
+        """
+        counts_flat = self.counts.reshape(-1)
+        cells = np.flatnonzero(counts_flat)
+        return cells, counts_flat[cells]
+
+    def add_df(self, df, latitude_column='latitude', longitude_column='longitude', altitude_column='altitude',
+               time_column='timestamp'):
+        """ count positions of a flight DataFrame (spire: altitude_column='altitude_baro')
+
+        Returns: number of positions counted
+
+        """
+        import pandas as pd
+        sr_time = pd.to_datetime(df[time_column], utc=True).dt.tz_convert(None)
+        return self.add(df[latitude_column].to_numpy(dtype=float), df[longitude_column].to_numpy(dtype=float),
+                        df[altitude_column].to_numpy(dtype=float), sr_time.to_numpy(dtype='datetime64[ns]'))
+
+    def _ensure_writable(self):
+        # a grid loaded with mmap_mode='r' is read-only. counts are copied in memory before modified
+        if not self.counts.flags.writeable:
+            self.counts = np.array(self.counts)
+
+    def _time_offset(self, other):
+        """ index of the first time bin of other in self
+
+        lat, lon and alt edges must be the same, and time_edges of other must be a contiguous
+        sub-range of time_edges of self (ex. a day of a month)
+        """
+        for name in ('lat_edges', 'lon_edges', 'alt_edges'):
+            if not np.array_equal(getattr(self, name), getattr(other, name)):
+                raise ValueError('{0} of the grids are different'.format(name))
+        offset = int(np.searchsorted(self.time_edges, other.time_edges[0]))
+        time_edges_self = self.time_edges[offset:offset + len(other.time_edges)]
+        if (len(time_edges_self) != len(other.time_edges)) or \
+                not np.allclose(time_edges_self, other.time_edges, rtol=0., atol=1e-3):
+            raise ValueError('time_edges of the other grid are not a contiguous sub-range of this grid')
+        return offset
+
+    def merge(self, other):
+        """ add counts of another grid
+
+        other may cover a part of the time range (ex. grids of each day into a grid of the month):
+        its counts are added at the matching time bins.
+
+        Args:
+            other (DensityGrid): grid with the same lat, lon and alt edges, and time_edges within time_edges of self
+
+        Returns: self
+
+        """
+        offset = self._time_offset(other)
+        self._ensure_writable()
+        n_time = other.shape[3]
+        self.counts[..., offset:offset + n_time] += np.asarray(other.counts).astype(self.counts.dtype)
+        return self
+
+    def save(self, dir_save):
+        """ save as counts.npy (can be memory-mapped) and edges.npz
+
+        Args:
+            dir_save (str): directory to save
+
+        Returns: dir_save
+
+        """
+        if not os.path.exists(dir_save):
+            os.makedirs(dir_save)
+        np.save(os.path.join(dir_save, FILENAME_COUNTS), self.counts)
+        np.savez(os.path.join(dir_save, FILENAME_EDGES), lat_edges=self.lat_edges, lon_edges=self.lon_edges,
+                 alt_edges=self.alt_edges, time_edges=self.time_edges)
+        return dir_save
+
+    @classmethod
+    def load(cls, dir_save, mmap_mode='r'):
+        """ load a saved grid
+
+        Args:
+            dir_save (str): directory made by save
+            mmap_mode (str): mode of np.load. 'r' maps counts without reading the whole file
+                (counts are copied in memory when the grid is modified by add or merge). None loads in memory
+
+        Returns: DensityGrid
+
+        """
+        counts = np.load(os.path.join(dir_save, FILENAME_COUNTS), mmap_mode=mmap_mode)
+        with np.load(os.path.join(dir_save, FILENAME_EDGES)) as edges:
+            return cls(edges['lat_edges'], edges['lon_edges'], edges['alt_edges'], edges['time_edges'],
+                       counts=counts)
+
+
+def _aggregate_file(edges, dtype, path, dict_columns, chunksize):
+    from src.dedup import read_output
+    grid = DensityGrid(*edges, dtype=dtype)
+    for df_chunk in read_output(path, chunksize=chunksize):
+        grid.add_df(df_chunk, **dict_columns)
+    # sparse result, so the parent does not receive a full grid per file
+    return grid.nonzero_cells()
+
+
+def aggregate_files(grid, list_path, processes=1, chunksize=CHUNK_SIZE_READ, latitude_column='latitude',
+                    longitude_column='longitude', altitude_column='altitude', time_column='timestamp'):
+    """ aggregate output files (ex. one per day) into grid, in parallel per file
+
+    Each result is added to grid as soon as it arrives, so memory is one grid per process
+    plus the non-zero cells of one file.
+
+    Args:
+        grid (DensityGrid): grid to add counts
+        list_path (list): paths to output files (csv, csv.gz, json, json.gz, pkl, parquet)
+        processes (int): number of processes
+        chunksize (int): number of rows read at once from csv and json
+
+    Returns: grid
+
+    """
+    from tqdm import tqdm
+    from multiprocessing import Pool
+    from src.helper import argwrapper
+    dict_columns = {
+        'latitude_column': latitude_column,
+        'longitude_column': longitude_column,
+        'altitude_column': altitude_column,
+        'time_column': time_column,
+    }
+    # edges only: pickling grid would send the whole counts to every task
+    edges = (grid.lat_edges, grid.lon_edges, grid.alt_edges, grid.time_edges)
+    func_args = [(_aggregate_file, edges, grid.counts.dtype, path, dict_columns, chunksize) for path in list_path]
+    if processes == 1:
+        for args in tqdm(func_args, total=len(func_args)):
+            grid.add_cells(*argwrapper(args))
+        return grid
+    p = Pool(processes)
+    try:
+        for cells, counts_cell in tqdm(p.imap_unordered(argwrapper, func_args), total=len(func_args)):
+            grid.add_cells(cells, counts_cell)
+    finally:
+        p.close()
+        p.join()
+    return grid
@@ -0,0 +1,194 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+M_PER_S_TO_KT = 3600. / 1852.
+CHUNK_ROWS = 2000000
+
+
+def haversine(lat1, lon1, lat2, lon2, radius=EARTH_RADIUS_M):
+    """ great-circle distance between points (broadcast over arrays)
+
+    Args:
+        lat1, lon1, lat2, lon2 (np.ndarray or float): coordinates in degrees
+        radius (float): earth radius (m)
+
+    Returns: distance (m)
+
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.) ** 2
+    return 2. * radius * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """ initial bearing from point 1 to point 2 (broadcast over arrays)
+
+    Args:
+        lat1, lon1, lat2, lon2 (np.ndarray or float): coordinates in degrees
+
+    Returns: bearing in degrees, 0-360 clockwise from north
+
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    d_lon = lon2 - lon1
+    y = np.sin(d_lon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)
+    return (np.degrees(np.arctan2(y, x)) + 360.) % 360.
+
+
+def cross_track_distance(lat, lon, lat_a, lon_a, lat_b, lon_b, radius=EARTH_RADIUS_M):
+    """ signed distance from points to the great circle through A and B
+
+    Args:
+        lat, lon (np.ndarray): coordinates of the points in degrees
+        lat_a, lon_a (float): start of the route (ex. departure airport) in degrees
+        lat_b, lon_b (float): end of the route (ex. arrival airport) in degrees
+        radius (float): earth radius (m)
+
+    Returns: distance (m), positive on the right side of the route
+
+    """
+    angle_a_point = haversine(lat_a, lon_a, lat, lon, radius=1.)
+    bearing_a_point = np.radians(bearing(lat_a, lon_a, lat, lon))
+    bearing_a_b = np.radians(bearing(lat_a, lon_a, lat_b, lon_b))
+    return np.arcsin(np.sin(angle_a_point) * np.sin(bearing_a_point - bearing_a_b)) * radius
+
+
+def compute_features(ids, time_sec, lat, lon, altitude_ft, route=None):
+    """ kinematic features between consecutive rows of the same aircraft
+
+    Rows must be sorted by (ids, time_sec). The first row of each aircraft has NaN for step features.
+
+    Args:
+        ids (np.ndarray): aircraft id of each row (ex. icao24)
+        time_sec (np.ndarray): time (sec)
+        lat, lon (np.ndarray): coordinates in degrees
+        altitude_ft (np.ndarray): altitude (ft)
+        route (tuple): (lat_a, lon_a, lat_b, lon_b) for cross track distance. If None, it is not computed
+
+    Returns: dict of np.ndarray
+        step_distance_m, step_time_sec, derived_speed_kt, bearing_deg, climb_rate_fpm (, cross_track_m)
+
+    """
+    n = len(ids)
+    dict_out = {
+        'step_distance_m': np.full(n, np.nan),
+        'step_time_sec': np.full(n, np.nan),
+        'derived_speed_kt': np.full(n, np.nan),
+        'bearing_deg': np.full(n, np.nan),
+        'climb_rate_fpm': np.full(n, np.nan),
+    }
+    if n > 1:
+        same_aircraft = ids[1:] == ids[:-1]
+        step_distance = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        step_time = (time_sec[1:] - time_sec[:-1]).astype(float)
+        step_time[step_time <= 0] = np.nan
+        step_altitude = (altitude_ft[1:] - altitude_ft[:-1]).astype(float)
+        dict_out['step_distance_m'][1:] = np.where(same_aircraft, step_distance, np.nan)
+        dict_out['step_time_sec'][1:] = np.where(same_aircraft, step_time, np.nan)
+        dict_out['derived_speed_kt'][1:] = np.where(same_aircraft, step_distance / step_time * M_PER_S_TO_KT, np.nan)
+        dict_out['bearing_deg'][1:] = np.where(same_aircraft, bearing(lat[:-1], lon[:-1], lat[1:], lon[1:]), np.nan)
+        dict_out['climb_rate_fpm'][1:] = np.where(same_aircraft, step_altitude / step_time * 60., np.nan)
+    if route is not None:
+        dict_out['cross_track_m'] = cross_track_distance(lat, lon, *route)
+    return dict_out
+
+
+def split_chunks_by_id(ids, chunk_rows=CHUNK_ROWS):
+    """ split sorted rows into chunks of about chunk_rows without splitting an aircraft
+
+    Args:
+        ids (np.ndarray): aircraft id of each row, sorted
+        chunk_rows (int): target number of rows per chunk
+
+    Returns: list of (start index, stop index)
+
+    """
+    n = len(ids)
+    if n == 0:
+        return []
+    index_boundary = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+    list_chunk = []
+    start = 0
+    while start < n:
+        stop = start + chunk_rows
+        if stop >= n:
+            stop = n
+        else:
+            i = np.searchsorted(index_boundary, stop)
+            # extend to the end of the current aircraft; one aircraft longer than chunk_rows is kept as one chunk
+            stop = int(index_boundary[i]) if i < len(index_boundary) else n
+        list_chunk.append((start, stop))
+        start = stop
+    return list_chunk
+
+
+def _compute_features_chunk(index_chunk, ids, time_sec, lat, lon, altitude_ft, route):
+    return index_chunk, compute_features(ids, time_sec, lat, lon, altitude_ft, route=route)
+
+
+def route_from_airports(departure_airport, arrival_airport, path_airport_info=None):
+    """ route (lat_a, lon_a, lat_b, lon_b) between two airports of airports.csv
+
+    Args:
+        departure_airport (str): ICAO ident (ex. 'RJFF')
+        arrival_airport (str): ICAO ident (ex. 'RJTT')
+        path_airport_info (str): path to airports.csv. Default is flight_info.PATH_AIRPORT_INFO
+
+    Returns: tuple of (lat_a, lon_a, lat_b, lon_b)
+
+    """
+    import pandas as pd
+    if path_airport_info is None:
+        from src.flight_info import PATH_AIRPORT_INFO
+        path_airport_info = PATH_AIRPORT_INFO
+    df_airport = pd.read_csv(path_airport_info, usecols=['ident', 'latitude_deg', 'longitude_deg']).set_index('ident')
+    lat_a, lon_a = df_airport.loc[departure_airport, ['latitude_deg', 'longitude_deg']]
+    lat_b, lon_b = df_airport.loc[arrival_airport, ['latitude_deg', 'longitude_deg']]
+    return float(lat_a), float(lon_a), float(lat_b), float(lon_b)
+
+
+def add_features_df(df, id_column='icao24', time_column='timestamp', latitude_column='latitude',
+                    longitude_column='longitude', altitude_column='altitude', route=None,
+                    chunk_rows=CHUNK_ROWS, processes=1):
+    """ add kinematic features to a flight DataFrame (opensky: defaults, spire: id_column='icao_address',
+    altitude_column='altitude_baro')
+
+    Args:
+        df (pd.DataFrame): flight positions
+        id_column (str): column of aircraft id
+        time_column (str): column of timestamp (datetime or parsable string)
+        latitude_column (str): column of latitude (deg)
+        longitude_column (str): column of longitude (deg)
+        altitude_column (str): column of altitude (ft)
+        route (tuple): (lat_a, lon_a, lat_b, lon_b), see route_from_airports
+        chunk_rows (int): rows per chunk. Chunks never split an aircraft
+        processes (int): number of processes. If 1, chunks are computed in this process
+
+    Returns: pd.DataFrame sorted by (id_column, time_column) with feature columns
+
+    """
+    import pandas as pd
+    from src.helper import argwrapper, imap_unordered_bar
+    df = df.sort_values(by=[id_column, time_column], kind='mergesort').reset_index(drop=True)
+    ids = df[id_column].to_numpy()
+    sr_time = pd.to_datetime(df[time_column], utc=True).dt.tz_convert(None)
+    time_sec = sr_time.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    lat = df[latitude_column].to_numpy(dtype=float)
+    lon = df[longitude_column].to_numpy(dtype=float)
+    altitude_ft = df[altitude_column].to_numpy(dtype=float)
+
+    list_chunk = split_chunks_by_id(ids, chunk_rows=chunk_rows)
+    func_args = [(_compute_features_chunk, index_chunk, ids[start:stop], time_sec[start:stop], lat[start:stop],
+                  lon[start:stop], altitude_ft[start:stop], route)
+                 for index_chunk, (start, stop) in enumerate(list_chunk)]
+    if processes == 1 or len(func_args) <= 1:
+        list_result = [argwrapper(args) for args in func_args]
+    else:
+        list_result = imap_unordered_bar(argwrapper, func_args, n_processes=processes, tqdm_disable=True)
+    list_result = [dict_out for index_chunk, dict_out in sorted(list_result, key=lambda x: x[0])]
+    if len(list_result) == 0:
+        return df
+    for column in list_result[0].keys():
+        df[column] = np.concatenate([dict_out[column] for dict_out in list_result])
+    return df
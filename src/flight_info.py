@@ -1,19 +1,46 @@
-from traffic.data import opensky
 import os
 import datetime
 import pytz
 from copy import deepcopy
-from tqdm import tqdm
-from dateutil.relativedelta import *
-
-import pandas as pd
 
 USER = os.getenv('USERNAME')
 PASSWORD = os.getenv('PASSWORD')
 PATH_AIRPORT_INFO = 'data/airports.csv'
 
-opensky.username = USER
-opensky.password = PASSWORD
+_opensky = None
+
+
+def get_opensky():
+    """ opensky client of traffic. traffic is imported and logged in on first use
+
+    Returns: traffic.data.opensky
+
+    """
+    global _opensky
+    if _opensky is None:
+        from traffic.data import opensky
+        opensky.username = USER
+        opensky.password = PASSWORD
+        _opensky = opensky
+    return _opensky
+
+
+def find_airport_ident(name_key, path_airport_info=PATH_AIRPORT_INFO):
+    """ ident of the first airport whose name contains name_key
+
+    Args:
+        name_key (str): part of the airport name (ex. 'Haneda')
+        path_airport_info (str): path to airports.csv
+
+    Returns: ident (ex. 'RJTT')
+
+    """
+    import pandas as pd
+    df_airport = pd.read_csv(path_airport_info)
+    list_ident = df_airport[df_airport['name'].str.contains(name_key)]['ident'].to_list()
+    if len(list_ident) == 0:
+        raise ValueError('airport is not found: {0}'.format(name_key))
+    return list_ident[0]
 
 
 def remove_row_flight_df(df, onground=False, min_ft=33000,
@@ -40,16 +67,24 @@ def remove_row_flight_df(df, onground=False, min_ft=33000,
 
 def get_history_data(start_datetime, end_datetime, interval_datetime=datetime.timedelta(hours=1), callsign=None,
                      icao24=None, departure_airport=None, arrival_airport=None, onground=False, min_ft=33000,
-                     time_interval=datetime.timedelta(minutes=1)):
+                     time_interval=datetime.timedelta(minutes=1), path_sink=None):
+    # path_sink: if given, each filtered slice is appended to this parquet file instead of being kept in memory,
+    # and a lazy handle (src.columnar.LazyParquet) is returned instead of a DataFrame
+    import pandas as pd
+    from tqdm import tqdm
     start_datetime_temp = deepcopy(start_datetime)
     end_datetime_temp = start_datetime_temp + interval_datetime
     list_out = []
+    sink = None
+    if path_sink is not None:
+        from src.columnar import ParquetSink
+        sink = ParquetSink(path_sink)
     pbar = tqdm(total=(end_datetime - start_datetime) // interval_datetime)
     while end_datetime_temp <= end_datetime:
         pbar.update(1)
         start_str = start_datetime_temp.strftime('%Y-%m-%d %H:%M')
         end_str = end_datetime_temp.strftime('%Y-%m-%d %H:%M')
-        flight = opensky.history(
+        flight = get_opensky().history(
             start=start_str,
             stop=end_str,
             callsign=callsign,
@@ -64,7 +99,10 @@ def get_history_data(start_datetime, end_datetime, interval_datetime=datetime.ti
                                            time_interval=time_interval,
                                            start_str=start_str, end_str=end_str)
 
-            list_out.append(df_temp)
+            if sink is not None:
+                sink.append(df_temp)
+            else:
+                list_out.append(df_temp)
         except AttributeError:
             print('nodata {0}-{1}'.format(start_str, end_str))
 
@@ -73,7 +111,7 @@ def get_history_data(start_datetime, end_datetime, interval_datetime=datetime.ti
     pbar.close()
     start_str = start_datetime_temp.strftime('%Y-%m-%d %H:%M')
     end_str = end_datetime.strftime('%Y-%m-%d %H:%M')
-    flight = opensky.history(
+    flight = get_opensky().history(
         start=start_str,
         stop=end_str,
         callsign=callsign,
@@ -87,9 +125,14 @@ def get_history_data(start_datetime, end_datetime, interval_datetime=datetime.ti
                                        onground=onground, min_ft=min_ft,
                                        time_interval=datetime.timedelta(minutes=1),
                                        start_str=start_str, end_str=end_str)
-        list_out.append(df_temp)
+        if sink is not None:
+            sink.append(df_temp)
+        else:
+            list_out.append(df_temp)
     except AttributeError:
         print('nodata {0}-{1}'.format(start_str, end_str))
+    if sink is not None:
+        return sink.close()
     return pd.concat(list_out)
 
 
@@ -125,7 +168,15 @@ class HistoricalLocationsData(object):
     def get_df_one_unit(self, target_date, callsign=None, icao24=None, departure_airport=None, arrival_airport=None,
                         calc_interval_datetime=datetime.timedelta(hours=1), save_local=False, dir_save=None,
                         pickle=True,
-                        tqdm_count=True):
+                        tqdm_count=True, file_format=None, lazy=False):
+        # file_format: 'pickle', 'csv' or 'parquet'. If None, 'pickle' if pickle else 'csv'
+        # lazy: if True, each filtered slice is appended to a parquet file right away (peak memory is one slice)
+        #       and src.columnar.LazyParquet is returned instead of a DataFrame. The file is
+        #       dir_save/<filename_head>.parquet if save_local (file_format is ignored), otherwise a temporary file
+        #       removed by LazyParquet.close(). If the unit has no rows, no file is made and the path is None
+        import pandas as pd
+        from tqdm import tqdm
+        from dateutil.relativedelta import relativedelta
         if self.file_batch_unit == 'daily':
             filename_head = target_date.strftime('%Y%m%d') + '_' + 'D'
             start_datetime = datetime.datetime.combine(target_date, datetime.datetime.min.time())
@@ -172,10 +223,21 @@ class HistoricalLocationsData(object):
         else:
             filename_head = filename_head + '_' + 'arr-all'
 
+        sink = None
+        if lazy:
+            from src.columnar import ParquetSink
+            if save_local:
+                sink = ParquetSink(os.path.join(dir_save, filename_head) + '.parquet')
+            else:
+                # the returned LazyParquet owns the temporary directory and removes it on close
+                import tempfile
+                dir_temp = tempfile.mkdtemp()
+                sink = ParquetSink(os.path.join(dir_temp, filename_head) + '.parquet', dir_temp=dir_temp)
+
         if calc_interval_datetime is None:
             start_str = start_datetime.strftime('%Y-%m-%d %H:%M')
             stop_str = stop_datetime.strftime('%Y-%m-%d %H:%M')
-            flight = opensky.history(
+            flight = get_opensky().history(
                 start=start_str,
                 stop=stop_str,
                 callsign=callsign,
@@ -189,7 +251,12 @@ class HistoricalLocationsData(object):
                 df_out = self._remove_row_flight_df(df_out, start_str=start_str, end_str=stop_str)
             except AttributeError:
                 print('nodata {0}-{1}'.format(start_str, stop_str))
+                if sink is not None:
+                    sink.close().close()
                 return None
+            if sink is not None:
+                sink.append(df_out)
+                df_out = sink.close()
         else:
             start_datetime_temp = deepcopy(start_datetime)
             stop_datetime_temp = start_datetime_temp + calc_interval_datetime
@@ -202,7 +269,7 @@ class HistoricalLocationsData(object):
                 if tqdm_count:
                     pbar.update(1)
                     pbar.set_description(start_str)
-                flight = opensky.history(
+                flight = get_opensky().history(
                     start=start_str,
                     stop=stop_str,
                     callsign=callsign,
@@ -214,7 +281,10 @@ class HistoricalLocationsData(object):
                 try:
                     df_temp = flight.data
                     df_temp = self._remove_row_flight_df(df_temp, start_str=start_str, end_str=stop_str)
-                    list_df_out.append(df_temp)
+                    if sink is not None:
+                        sink.append(df_temp)
+                    else:
+                        list_df_out.append(df_temp)
                 except AttributeError:
                     print('nodata {0}-{1}'.format(start_str, stop_str))
                 start_datetime_temp = start_datetime_temp + calc_interval_datetime
@@ -225,7 +295,7 @@ class HistoricalLocationsData(object):
 
             start_str = start_datetime_temp.strftime('%Y-%m-%d %H:%M')
             stop_str = stop_datetime.strftime('%Y-%m-%d %H:%M')
-            flight = opensky.history(
+            flight = get_opensky().history(
                 start=start_str,
                 stop=stop_str,
                 callsign=callsign,
@@ -236,17 +306,44 @@ class HistoricalLocationsData(object):
             try:
                 df_temp = flight.data
                 df_temp = self._remove_row_flight_df(df_temp, start_str=start_str, end_str=stop_str)
-                list_df_out.append(df_temp)
+                if sink is not None:
+                    sink.append(df_temp)
+                else:
+                    list_df_out.append(df_temp)
             except AttributeError:
                 print('nodata {0}-{1}'.format(start_str, stop_str))
-            df_out = pd.concat(list_df_out)
+            if sink is not None:
+                df_out = sink.close()
+            else:
+                df_out = pd.concat(list_df_out)
 
         if save_local:
             if not os.path.exists(dir_save):
                 os.makedirs(dir_save)
 
+            if file_format is None:
+                file_format = 'pickle' if pickle else 'csv'
             path_dest = os.path.join(dir_save, filename_head)
-            if pickle:
+            if (sink is not None) and (sink.n_rows == 0):
+                # no file is made for an empty unit
+                print('nodata {0}'.format(filename_head))
+                path_dest = None
+            elif sink is not None:
+                from src.columnar import update_dataset_index
+                path_dest = sink.path
+                update_dataset_index(dir_save, path_dest, sink,
+                                     start_datetime=start_datetime, stop_datetime=stop_datetime,
+                                     callsign=callsign, icao24=icao24, departure_airport=departure_airport,
+                                     arrival_airport=arrival_airport)
+            elif file_format == 'parquet':
+                from src.columnar import write_parquet, update_dataset_index
+                path_dest = path_dest + '.parquet'
+                write_parquet(df_out, path_dest)
+                update_dataset_index(dir_save, path_dest, df_out,
+                                     start_datetime=start_datetime, stop_datetime=stop_datetime,
+                                     callsign=callsign, icao24=icao24, departure_airport=departure_airport,
+                                     arrival_airport=arrival_airport)
+            elif file_format == 'pickle':
                 path_dest = path_dest + '.pkl'
                 df_out.to_pickle(path=path_dest)
             else:
@@ -260,7 +357,12 @@ class HistoricalLocationsData(object):
     def get_df_time_range(self, start_date, stop_date, callsign=None, icao24=None, departure_airport=None,
                           arrival_airport=None,
                           calc_interval_datetime=datetime.timedelta(hours=1), save_local=False, dir_save=None,
-                          pickle=True):
+                          pickle=True, file_format=None):
+        # with file_format='parquet', dir_save becomes a dataset of one file per unit with an index (_index/),
+        # which src.columnar.read_dataset reads with filters. Units are streamed to the files (lazy) since
+        # only the paths are returned
+        from tqdm import tqdm
+        from dateutil.relativedelta import relativedelta
         if self.file_batch_unit == 'daily':
             list_path = []
             target_date = deepcopy(start_date)
@@ -277,9 +379,12 @@ class HistoricalLocationsData(object):
                                                          save_local=save_local,
                                                          dir_save=dir_save,
                                                          pickle=pickle,
-                                                         tqdm_count=False
+                                                         tqdm_count=False,
+                                                         file_format=file_format,
+                                                         lazy=save_local and file_format == 'parquet'
                                                          )
-                list_path.append(path_dest)
+                if path_dest is not None:
+                    list_path.append(path_dest)
                 target_date = target_date + datetime.timedelta(days=1)
 
             pbar.close()
@@ -301,9 +406,12 @@ class HistoricalLocationsData(object):
                                                          save_local=save_local,
                                                          dir_save=dir_save,
                                                          pickle=pickle,
-                                                         tqdm_count=False
+                                                         tqdm_count=False,
+                                                         file_format=file_format,
+                                                         lazy=save_local and file_format == 'parquet'
                                                          )
-                list_path.append(path_dest)
+                if path_dest is not None:
+                    list_path.append(path_dest)
                 target_date = target_date + relativedelta(months=+1)
             pbar.close()
         else:
@@ -312,122 +420,3 @@ class HistoricalLocationsData(object):
 
         return list_path
 
-
-def test_1():
-    airport_depart_name_key = 'Fukuoka'
-    airport_arrival_name_key = 'Haneda'
-    start_datetime = datetime.datetime(year=2018, month=11, day=14, hour=8, minute=0, tzinfo=pytz.utc)
-    end_datetime = datetime.datetime(year=2018, month=11, day=15, hour=8, minute=0, tzinfo=pytz.utc)
-    interval_datetime = datetime.timedelta(hours=1)
-    onground = False
-    min_ft = 33000
-    time_interval = datetime.timedelta(minutes=1)
-
-    df_airport = pd.read_csv(PATH_AIRPORT_INFO)
-
-    airport_depart_ident = df_airport[df_airport['name'].str.contains(airport_depart_name_key)]['ident'].to_list()
-    airport_arrival_ident = df_airport[df_airport['name'].str.contains(airport_arrival_name_key)]['ident'].to_list()
-    print(airport_depart_ident, airport_arrival_ident)
-
-    df = get_history_data(start_datetime, end_datetime,
-                          interval_datetime=interval_datetime,
-                          callsign=None,
-                          icao24=None,
-                          departure_airport=airport_depart_ident[0],
-                          arrival_airport=airport_arrival_ident[0],
-                          onground=onground, min_ft=min_ft,
-                          time_interval=time_interval
-                          )
-
-    print(df)
-
-
-def test_2():
-    airport_depart_name_key = 'Fukuoka'
-    airport_arrival_name_key = 'Haneda'
-
-    target_date = datetime.date(year=2018, month=11, day=14)
-    callsign = None
-    icao24 = None
-    calc_interval_datetime = datetime.timedelta(hours=1)
-
-    save_local = True
-    dir_save = 'data/output'
-    pickle = False
-
-    file_batch_unit = 'daily'
-    time_interval = datetime.timedelta(minutes=1)
-
-    df_airport = pd.read_csv(PATH_AIRPORT_INFO)
-    airport_depart_ident = df_airport[df_airport['name'].str.contains(airport_depart_name_key)]['ident'].to_list()
-    airport_arrival_ident = df_airport[df_airport['name'].str.contains(airport_arrival_name_key)]['ident'].to_list()
-    print(airport_depart_ident, airport_arrival_ident)
-    airport_depart_ident = airport_depart_ident[0]
-    airport_arrival_ident = airport_arrival_ident[0]
-
-    historical_locations_data = HistoricalLocationsData(file_batch_unit=file_batch_unit,
-                                                        time_interval=time_interval
-                                                        )
-    df = historical_locations_data.get_df_one_unit(target_date=target_date,
-                                                   callsign=callsign,
-                                                   icao24=icao24,
-                                                   departure_airport=airport_depart_ident,
-                                                   arrival_airport=airport_arrival_ident,
-                                                   calc_interval_datetime=calc_interval_datetime,
-                                                   save_local=save_local,
-                                                   dir_save=dir_save,
-                                                   pickle=pickle
-                                                   )
-
-
-def test_3():
-    # todo: airport should not be decided for searching because the time range
-    airport_depart_name_key = 'Fukuoka'
-    airport_arrival_name_key = 'Haneda'
-
-    start_date = datetime.date(year=2018, month=11, day=14)
-    stop_date = datetime.date(year=2018, month=11, day=16)
-    callsign = None
-    icao24 = None
-    calc_interval_datetime = datetime.timedelta(hours=1)
-
-    save_local = True
-    dir_save = 'data/output'
-    pickle = False
-
-    file_batch_unit = 'daily'
-    time_interval = datetime.timedelta(minutes=1)
-
-    df_airport = pd.read_csv(PATH_AIRPORT_INFO)
-    airport_depart_ident = df_airport[df_airport['name'].str.contains(airport_depart_name_key)]['ident'].to_list()
-    airport_arrival_ident = df_airport[df_airport['name'].str.contains(airport_arrival_name_key)]['ident'].to_list()
-    print(airport_depart_ident, airport_arrival_ident)
-    airport_depart_ident = airport_depart_ident[0]
-    airport_arrival_ident = airport_arrival_ident[0]
-
-    historical_locations_data = HistoricalLocationsData(file_batch_unit=file_batch_unit,
-                                                        time_interval=time_interval
-                                                        )
-    list_path = historical_locations_data.get_df_time_range(start_date=start_date,
-                                                            stop_date=stop_date,
-                                                            callsign=callsign,
-                                                            icao24=icao24,
-                                                            departure_airport=airport_depart_ident,
-                                                            arrival_airport=airport_arrival_ident,
-                                                            calc_interval_datetime=calc_interval_datetime,
-                                                            save_local=save_local,
-                                                            dir_save=dir_save,
-                                                            pickle=pickle
-                                                            )
-    print(list_path)
-
-    return
-
-
-def main():
-    # test_1()
-    # test_2()
-    test_3()
-
-if __name__ == "__main__":
-    main()
@@ -1,11 +1,30 @@
-from tqdm import tqdm
-from multiprocessing import Pool
-import boto3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 
 def argwrapper(args):
     return args[0](*args[1:])
 
+def split_time_range(start, stop, interval):
+    """ split [start, stop] into consecutive slices of interval. The last slice ends at stop
+
+    Args:
+        start (datetime.datetime): start of the range
+        stop (datetime.datetime): stop of the range
+        interval (datetime.timedelta): length of a slice
+
+    Returns: list of (slice start, slice stop)
+
+    """
+    list_range = []
+    start_temp = start
+    stop_temp = start_temp + interval
+    while stop_temp < stop:
+        list_range.append((start_temp, stop_temp))
+        start_temp = start_temp + interval
+        stop_temp = start_temp + interval
+    list_range.append((start_temp, stop))
+    return list_range
+
 def imap_unordered_bar(func, args, n_processes=15, extend=False, tqdm_disable=False,
                        init=None, credentials=None):
     """ execute for loop with multiprocessing
@@ -23,6 +42,8 @@ def imap_unordered_bar(func, args, n_processes=15, extend=False, tqdm_disable=Fa
     Returns: appended or extended list
 
     """
+    from tqdm import tqdm
+    from multiprocessing import Pool
     if (init is not None) and (credentials is not None):
         p = Pool(n_processes, initializer=init, initargs=credentials)
     else:
@@ -40,8 +61,47 @@ def imap_unordered_bar(func, args, n_processes=15, extend=False, tqdm_disable=Fa
     p.join()
     return res_list
 
+def iter_unordered_bounded(func, args, n_workers=4, max_pending=None):
+    """ yield results in completion order while keeping the number of running tasks bounded
+
+    New tasks are submitted only when the consumer pulls the next result, so a slow consumer
+    throttles the producers (backpressure) instead of piling up finished results in memory.
+
+    Args:
+        func (def): function of arg wrapper (argwrapper)
+        args (list of args):  ex. [(target function, args of functions) for xx in xxxx]
+        n_workers (int): number of worker threads
+        max_pending (int): maximum number of submitted but not yet consumed tasks. Default is n_workers
+
+    Returns: generator of results in completion order
+
+    """
+    if max_pending is None:
+        max_pending = n_workers
+    iter_args = iter(args)
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    set_future = set()
+    try:
+        for arg in iter_args:
+            set_future.add(executor.submit(func, arg))
+            if len(set_future) >= max_pending:
+                break
+        while set_future:
+            set_done, set_future = wait(set_future, return_when=FIRST_COMPLETED)
+            for future in set_done:
+                yield future.result()
+                for arg in iter_args:
+                    set_future.add(executor.submit(func, arg))
+                    break
+    finally:
+        # the consumer may stop early (break / close). Do not block on tasks still running.
+        # (shutdown(cancel_futures=True) needs python 3.9)
+        for future in set_future:
+            future.cancel()
+        executor.shutdown(wait=False)
+
 def transfer_to_s3(path_local, dir_local_parent=None, dir_s3_parent=None, remove_local_file=False, multiprocessing=False,
-                   s3_bucket_name=None):
+                   s3_bucket_name=None, skip_if_exists=False, dict_hash=None):
     """ transfer local file to s3 bucket
 
     Args:
@@ -50,10 +110,14 @@ def transfer_to_s3(path_local, dir_local_parent=None, dir_s3_parent=None, remove
         dir_s3_parent (char): path on S3 bucket. The child path is attached after this path (ex. 'Macro_Yield/data/converted')
         remove_local_file (bool): If True, path_local will be removed
         multiprocessing (bool): If True, this code can be suit to multiprocessing
+        skip_if_exists (bool): If True, upload is skipped when the object on S3 has the same sha256 (metadata)
+            or the same md5 (ETag of a single part upload)
+        dict_hash (dict): sha256 and md5 of path_local if they are already computed (see storage.hash_file)
 
     Returns: url of the saved file on S3
 
     """
+    import boto3
     if not multiprocessing:
         s3 = boto3.resource('s3')
         bucket = s3.Bucket(s3_bucket_name)
@@ -74,7 +138,11 @@ def transfer_to_s3(path_local, dir_local_parent=None, dir_s3_parent=None, remove
         dest_path = os.path.join(dir_s3_parent, path_child)
     else:
         dest_path = str(path_child)
-    bucket.upload_file(path_local, dest_path)
+    if dict_hash is None:
+        from src.storage import hash_file
+        dict_hash = hash_file(path_local)
+    if not (skip_if_exists and _exists_same_s3_object(s3, s3_bucket_name, dest_path, dict_hash)):
+        bucket.upload_file(path_local, dest_path, ExtraArgs={'Metadata': {'sha256': dict_hash['sha256']}})
     url_s3 = "https://{0}.s3-{1}.amazonaws.com/{2}".format(
         s3_bucket_name,
         bucket_location['LocationConstraint'],
@@ -83,4 +151,31 @@ def transfer_to_s3(path_local, dir_local_parent=None, dir_s3_parent=None, remove
     if remove_local_file:
         os.remove(path_local)
 
-    return url_s3
\ No newline at end of file
+    return url_s3
+
+def get_s3_object(url_s3):
+    """ read an object uploaded by transfer_to_s3
+
+    Args:
+        url_s3 (str): url returned by transfer_to_s3 (https://<bucket>.s3-<region>.amazonaws.com/<key>)
+
+    Returns: content (bytes)
+
+    """
+    import boto3
+    from urllib.parse import urlparse, unquote
+    url_parsed = urlparse(url_s3)
+    s3_bucket_name = url_parsed.netloc.split('.s3-')[0]
+    key = unquote(url_parsed.path[1:])
+    response = boto3.client('s3').get_object(Bucket=s3_bucket_name, Key=key)
+    return response['Body'].read()
+
+def _exists_same_s3_object(s3_client, s3_bucket_name, key, dict_hash):
+    from botocore.exceptions import ClientError
+    try:
+        response = s3_client.head_object(Bucket=s3_bucket_name, Key=key)
+    except ClientError:
+        return False
+    if response.get('Metadata', {}).get('sha256') == dict_hash['sha256']:
+        return True
+    return response.get('ETag', '').strip('"') == dict_hash['md5']
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+
+FILENAME_MANIFEST = 'manifest.jsonl'
+DIR_OBJECTS = 'objects'
+LENGTH_KEY = 16
+CHUNK_SIZE_HASH = 1024 * 1024
+
+
+def query_key(query):
+    """ short key of a query
+
+    Args:
+        query (str): canonical query string (ex. url_query of historicalapi.query_request)
+
+    Returns: first LENGTH_KEY hex characters of sha256
+
+    """
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()[:LENGTH_KEY]
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE_HASH):
+    """ sha256 and md5 of a file, read in chunks
+
+    Args:
+        path (str): path to the file
+        chunk_size (int): size of the chunks (bytes)
+
+    Returns: dictionary of sha256, md5 (hex), size (bytes)
+
+    """
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+    return {'sha256': sha256.hexdigest(), 'md5': md5.hexdigest(), 'size': size}
+
+
+def content_path(sha256, ext):
+    """ relative path of an object in the content-addressed layout
+
+    Args:
+        sha256 (str): hex digest of the content
+        ext (str): extension (ex. '.csv.gz')
+
+    Returns: ex. 'objects/ab/ab12cd34ef56ab78.csv.gz'
+
+    """
+    return os.path.join(DIR_OBJECTS, sha256[:2], sha256[:LENGTH_KEY] + ext)
+
+
+class Manifest(object):
+    """ json lines file mapping query keys to stored objects
+
+    Entries are only appended (the last entry of a key wins), so several processes can add entries
+    to the same manifest.
+    """
+    def __init__(self, dir_root):
+        self.dir_root = dir_root
+        self.path_manifest = os.path.join(dir_root, FILENAME_MANIFEST)
+
+    def load(self):
+        """ read the manifest
+
+        Returns: dict of key: entry
+
+        """
+        dict_entry = {}
+        if not os.path.exists(self.path_manifest):
+            return dict_entry
+        with open(self.path_manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut by a killed process
+                    continue
+                dict_entry[entry['key']] = entry
+        return dict_entry
+
+    def get(self, key):
+        return self.load().get(key)
+
+    def put(self, key, **kwargs):
+        """ append an entry
+
+        Args:
+            key (str): query key
+            **kwargs: contents of the entry (query, path, sha256, md5, size, url_s3, ...)
+
+        Returns: entry
+
+        """
+        if not os.path.exists(self.dir_root):
+            os.makedirs(self.dir_root)
+        entry = dict(kwargs)
+        entry['key'] = key
+        entry['updated'] = time.time()
+        with open(self.path_manifest, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+        return entry
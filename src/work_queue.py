@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import datetime
+import threading
+from dateutil.parser import isoparse
+from dateutil.relativedelta import relativedelta
+from src.helper import split_time_range
+
+PATH_QUEUE_DB = 'data/output/queue/work_queue.sqlite'
+LEASE_TIME = 600
+HEARTBEAT_INTERVAL = 60
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 10
+
+STATE_PENDING = 'pending'
+STATE_LEASED = 'leased'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {'__timedelta__': value.total_seconds()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if '__datetime__' in value:
+            return isoparse(value['__datetime__'])
+        if '__date__' in value:
+            return isoparse(value['__date__']).date()
+        if '__timedelta__' in value:
+            return datetime.timedelta(seconds=value['__timedelta__'])
+    return value
+
+
+def encode_payload(payload):
+    """ serialize a task payload (datetime, date and timedelta are kept) into json
+
+    Args:
+        payload (dict): arguments of the task
+
+    Returns: json string (keys are sorted, so the same payload gives the same string)
+
+    """
+    return json.dumps({key: _encode_value(value) for key, value in payload.items()}, sort_keys=True)
+
+
+def decode_payload(payload_json):
+    """ deserialize a task payload made by encode_payload
+
+    Args:
+        payload_json (str): json string
+
+    Returns: dict
+
+    """
+    return {key: _decode_value(value) for key, value in json.loads(payload_json).items()}
+
+
+class SQLiteWorkQueue(object):
+    """ work queue on a SQLite file, shared by containers through a volume
+
+    A worker leases a task for lease_time seconds and extends the lease by heartbeat while working.
+    Tasks whose lease expired (ex. the container died) are leased again up to max_attempts.
+    The same (kind, payload) is enqueued only once, so rerunning the coordinator does not duplicate work.
+    """
+    def __init__(self, path_db=PATH_QUEUE_DB, lease_time=LEASE_TIME, max_attempts=MAX_ATTEMPTS):
+        self.path_db = path_db
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        dir_db = os.path.dirname(path_db)
+        if dir_db and not os.path.exists(dir_db):
+            os.makedirs(dir_db)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expire REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    updated REAL,
+                    UNIQUE(kind, payload)
+                )""")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, lease_expire)')
+
+    def _connect(self):
+        # connection per call: safe across threads (heartbeat) and processes
+        conn = sqlite3.connect(self.path_db, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Transaction(conn)
+
+    def enqueue(self, kind, list_payload):
+        """ add tasks
+
+        Args:
+            kind (str): kind of the task (ex. 'spire', 'opensky')
+            list_payload (list): list of dict of task arguments
+
+        Returns: number of newly added tasks
+
+        """
+        now = time.time()
+        n_added = 0
+        with self._connect() as conn:
+            for payload in list_payload:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO tasks (kind, payload, state, updated) VALUES (?, ?, ?, ?)',
+                    (kind, encode_payload(payload), STATE_PENDING, now))
+                n_added += cursor.rowcount
+        return n_added
+
+    def lease(self, worker_id):
+        """ lease one pending task (or a task whose lease expired)
+
+        Args:
+            worker_id (str): id of the worker
+
+        Returns: dict of task_id, kind, payload, attempts or None if no task is available
+
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE tasks SET state = ?, error = ?, updated = ? '
+                         'WHERE state = ? AND lease_expire < ? AND attempts >= ?',
+                         (STATE_FAILED, 'lease expired', now, STATE_LEASED, now, self.max_attempts))
+            row = conn.execute(
+                'SELECT task_id, kind, payload, attempts FROM tasks '
+                'WHERE (state = ? OR (state = ? AND lease_expire < ?)) AND attempts < ? '
+                'ORDER BY task_id LIMIT 1',
+                (STATE_PENDING, STATE_LEASED, now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE tasks SET state = ?, worker_id = ?, lease_expire = ?, attempts = attempts + 1, '
+                         'updated = ? WHERE task_id = ?',
+                         (STATE_LEASED, worker_id, now + self.lease_time, now, row['task_id']))
+        return {
+            'task_id': row['task_id'],
+            'kind': row['kind'],
+            'payload': decode_payload(row['payload']),
+            'attempts': row['attempts'] + 1
+        }
+
+    def heartbeat(self, task_id, worker_id):
+        """ extend the lease of a task
+
+        Returns: False if the lease was lost (expired and taken by another worker)
+
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute('UPDATE tasks SET lease_expire = ?, updated = ? '
+                                  'WHERE task_id = ? AND worker_id = ? AND state = ?',
+                                  (now + self.lease_time, now, task_id, worker_id, STATE_LEASED))
+        return cursor.rowcount > 0
+
+    def ack(self, task_id, worker_id, result=None):
+        """ mark a leased task as done
+
+        Args:
+            task_id (int): task id
+            worker_id (str): id of the worker
+            result (json serializable): result of the task (ex. list of paths)
+
+        Returns: False if the lease was lost before ack
+
+        """
+        with self._connect() as conn:
+            cursor = conn.execute('UPDATE tasks SET state = ?, result = ?, updated = ? '
+                                  'WHERE task_id = ? AND worker_id = ? AND state = ?',
+                                  (STATE_DONE, json.dumps(result), time.time(), task_id, worker_id, STATE_LEASED))
+        return cursor.rowcount > 0
+
+    def fail(self, task_id, worker_id, error):
+        """ release a leased task after an error. It is retried until max_attempts
+
+        Returns: False if the lease was lost
+
+        """
+        with self._connect() as conn:
+            cursor = conn.execute('UPDATE tasks SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, '
+                                  'error = ?, lease_expire = NULL, updated = ? '
+                                  'WHERE task_id = ? AND worker_id = ? AND state = ?',
+                                  (self.max_attempts, STATE_PENDING, STATE_FAILED, str(error), time.time(),
+                                   task_id, worker_id, STATE_LEASED))
+        return cursor.rowcount > 0
+
+    def count_state(self):
+        """ number of tasks per state
+
+        Returns: dict of state: count
+
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT state, COUNT(*) AS n FROM tasks GROUP BY state').fetchall()
+        return {row['state']: row['n'] for row in rows}
+
+
+class _Transaction(object):
+    """ `with` block of one IMMEDIATE transaction; the connection is closed at the end """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.conn.execute('COMMIT')
+            else:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self.conn.close()
+        return False
+
+
+def enqueue_spire_slices(queue, time_interval_start, time_interval_stop, query_time_interval, **kwargs):
+    """ coordinator: enqueue slices of a spire historical query
+
+    Args:
+        queue (SQLiteWorkQueue): work queue
+        time_interval_start (datetime.datetime): start datetime of query time range
+        time_interval_stop (datetime.datetime): end datetime of query time range
+        query_time_interval (datetime.timedelta): length of one task
+        **kwargs: other arguments of historicalapi.query_request (icao_address, callsign, out_format, ...)
+
+    Returns: number of newly added tasks
+
+    """
+    list_payload = []
+    for start, stop in split_time_range(time_interval_start, time_interval_stop, query_time_interval):
+        payload = dict(kwargs)
+        payload['time_interval_start'] = start
+        payload['time_interval_stop'] = stop
+        list_payload.append(payload)
+    return queue.enqueue('spire', list_payload)
+
+
+def enqueue_opensky_units(queue, start_date, stop_date, file_batch_unit='daily', **kwargs):
+    """ coordinator: enqueue daily or monthly units of opensky history
+
+    Args:
+        queue (SQLiteWorkQueue): work queue
+        start_date (datetime.date): first date
+        stop_date (datetime.date): stop date (exclusive)
+        file_batch_unit (str): 'daily' or 'monthly'
+        **kwargs: other arguments of HistoricalLocationsData.get_df_one_unit (callsign, departure_airport, ...)
+
+    Returns: number of newly added tasks
+
+    """
+    if file_batch_unit == 'daily':
+        step = relativedelta(days=+1)
+        target_date = start_date
+    elif file_batch_unit == 'monthly':
+        step = relativedelta(months=+1)
+        target_date = datetime.date(year=start_date.year, month=start_date.month, day=1)
+    else:
+        raise ValueError('file_batch_unit should be daily or monthly: {0}'.format(file_batch_unit))
+    list_payload = []
+    while target_date + step <= stop_date:
+        payload = dict(kwargs)
+        payload['file_batch_unit'] = file_batch_unit
+        payload['target_date'] = target_date
+        list_payload.append(payload)
+        target_date = target_date + step
+    return queue.enqueue('opensky', list_payload)
+
+
+def run_spire_task(payload, dir_save=None, save_s3=False, remove_local_file=False, max_wait_time=60):
+    from src.spire.historicalapi import QueryGetManager, DIR_SAVE
+    payload = dict(payload)
+    if dir_save is None:
+        dir_save = DIR_SAVE
+    query_get_manager = QueryGetManager(out_format=payload.pop('out_format', 'CSV'),
+                                        compression=payload.pop('compression', None))
+    query_get_manager.query_request(query_time_interval=None, skip_existing=True, dir_save=dir_save, **payload)
+    return query_get_manager.get_data_bulk(max_wait_time=max_wait_time, random_wait=True,
+                                           dir_save=dir_save, processes=1,
+                                           save_s3=save_s3, remove_local_file=remove_local_file)
+
+
+def run_opensky_task(payload, dir_save='data/output', file_format='pickle'):
+    from src.flight_info import HistoricalLocationsData
+    payload = dict(payload)
+    historical_locations_data = HistoricalLocationsData(file_batch_unit=payload.pop('file_batch_unit'))
+    df_out, path_dest = historical_locations_data.get_df_one_unit(save_local=True, dir_save=dir_save,
+                                                                  file_format=file_format, tqdm_count=False,
+                                                                  **payload)
+    return [path_dest]
+
+
+DICT_TASK_RUNNER = {
+    'spire': run_spire_task,
+    'opensky': run_opensky_task,
+}
+
+
+def run_worker(queue, worker_id=None, poll_interval=POLL_INTERVAL, heartbeat_interval=HEARTBEAT_INTERVAL,
+               exit_when_empty=True, dict_task_options=None):
+    """ worker: lease, heartbeat and ack tasks until the queue is empty
+
+    Args:
+        queue (SQLiteWorkQueue): work queue
+        worker_id (str): id of the worker. Default is hostname-pid
+        poll_interval (int): waiting time (sec) when no task is available
+        heartbeat_interval (int): interval (sec) of extending the lease. Should be shorter than queue.lease_time
+        exit_when_empty (bool): If True, return when no task is pending or leased
+        dict_task_options (dict): keyword arguments for each task runner, ex. {'spire': {'save_s3': True}}
+
+    Returns: number of tasks done by this worker
+
+    """
+    if worker_id is None:
+        worker_id = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+    if dict_task_options is None:
+        dict_task_options = {}
+    n_done = 0
+    while True:
+        task = queue.lease(worker_id)
+        if task is None:
+            dict_count = queue.count_state()
+            if exit_when_empty and dict_count.get(STATE_PENDING, 0) == 0 and dict_count.get(STATE_LEASED, 0) == 0:
+                return n_done
+            time.sleep(poll_interval)
+            continue
+
+        print('Worker: {0}  task: {1}  kind: {2}  attempts: {3}'.format(worker_id, task['task_id'], task['kind'],
+                                                                       task['attempts']))
+        event_stop = threading.Event()
+
+        def heartbeat():
+            wait_time = heartbeat_interval
+            while not event_stop.wait(wait_time):
+                try:
+                    is_extended = queue.heartbeat(task['task_id'], worker_id)
+                except sqlite3.OperationalError as e:
+                    # ex. lock timeout on a busy shared volume. retry soon, before the lease expires
+                    print('heartbeat failed: task {0}: {1}'.format(task['task_id'], e))
+                    wait_time = max(heartbeat_interval // 5, 1)
+                    continue
+                if not is_extended:
+                    print('lease lost: task {0}'.format(task['task_id']))
+                    return
+                wait_time = heartbeat_interval
+
+        thread_heartbeat = threading.Thread(target=heartbeat, daemon=True)
+        thread_heartbeat.start()
+        try:
+            func = DICT_TASK_RUNNER[task['kind']]
+            result = func(task['payload'], **dict_task_options.get(task['kind'], {}))
+        except Exception as e:
+            event_stop.set()
+            thread_heartbeat.join()
+            print('task {0} failed: {1}'.format(task['task_id'], e))
+            queue.fail(task['task_id'], worker_id, e)
+            continue
+        event_stop.set()
+        thread_heartbeat.join()
+        if queue.ack(task['task_id'], worker_id, result=result):
+            n_done += 1
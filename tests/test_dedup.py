@@ -0,0 +1,21 @@
+import os
+import pandas as pd
+from src.dedup import DedupStore
+
+
+def test_add_files_dedup_across_csv_and_pkl(tmp_path):
+    df = pd.DataFrame({
+        'icao24': ['86d6a4', '86d6a4', '8467e1', '8467e1'],
+        'timestamp': pd.to_datetime(['2018-11-14 00:00:01', '2018-11-14 00:01:01',
+                                     '2018-11-14 00:00:01', '2018-11-14 01:00:01'], utc=True),
+        'altitude': [35000., 35100., 37000., 37000.],
+    })
+    path_csv = os.path.join(str(tmp_path), 'unit.csv')
+    path_pkl = os.path.join(str(tmp_path), 'unit.pkl')
+    df.to_csv(path_csv, index=False)
+    df.to_pickle(path_pkl)
+
+    store = DedupStore(os.path.join(str(tmp_path), 'store'))
+    store.add_files([path_csv, path_pkl])
+    df_out = pd.concat(list(store.iter_partitions()), ignore_index=True)
+    assert len(df_out) == 4